@@ -1,21 +1,33 @@
-import re
 import os
 import glob
 
+id_prefix = '"id": "/subscriptions/'
+snapshot_marker = '/providers/Microsoft.Compute/snapshots/'
+
+def find_snapshot_rids(line):
+    # Plain substring scans; a line holds at most a few "id" fields
+    start = line.find(id_prefix)
+    while start != -1:
+        start += len('"id": "')
+        end = line.find('"', start)
+        if end == -1:
+            return
+        rid = line[start:end]
+        if snapshot_marker in rid:
+            yield rid
+        start = line.find(id_prefix, end)
+
 def extract_snapshot_rids(log_file_path, output_file_paths):
+    # Stream the log line by line instead of reading it whole
     with open(log_file_path, 'r') as log_file:
-        log_content = log_file.read()
-
-    # Regular expression to find snapshot Resource IDs
-    pattern = r'"id": "(\/subscriptions\/[^"]+\/providers\/Microsoft\.Compute\/snapshots\/[^"]+)"'
-    snapshot_rids = re.findall(pattern, log_content)
+        snapshot_rids = [rid for line in log_file for rid in find_snapshot_rids(line)]
 
-    # Ensure the directories exist and write the Resource IDs to all output files
+    # Build the payload once and append it to each output file with a single write
+    payload = "".join(f"{rid}\n" for rid in snapshot_rids).encode()
     for output_file_path in output_file_paths:
         os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-        with open(output_file_path, 'a') as output_file:
-            for rid in snapshot_rids:
-                output_file.write(f"{rid}\n")
+        with open(output_file_path, 'ab') as output_file:
+            output_file.write(payload)
 
     print(f"Extracted {len(snapshot_rids)} snapshot Resource IDs and appended to {', '.join(output_file_paths)}")
 
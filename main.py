@@ -1,9 +1,15 @@
 import os
 import time
 import subprocess
-import json
+import shlex
+import orjson
 import asyncio
+import random
 import logging
+import logging.handlers
+import queue
+import atexit
+import functools
 import traceback
 import csv
 import sys
@@ -12,6 +18,13 @@ import datetime
 import venv
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import defaultdict
+from dataclasses import dataclass
+import aiofiles
+import aiohttp
+from azure.core.exceptions import AzureError, ClientAuthenticationError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import DefaultAzureCredential
+from azure.mgmt.compute.aio import ComputeManagementClient
 from rich.console import Console
 from rich.live import Live
 from rich.panel import Panel
@@ -27,42 +40,85 @@ os.makedirs(log_dir, exist_ok=True)
 logging.basicConfig(filename=os.path.join(log_dir, 'azure_manager.log'), level=logging.DEBUG,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
+def env_concurrency(name, default):
+    # A bad value falls back to the default instead of failing at import; anything below 1 would never run
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        concurrency = int(value)
+    except ValueError:
+        console.print(f"[yellow]Warning: {name}={value!r} is not a number; using {default}.[/yellow]")
+        return default
+    if concurrency < 1:
+        console.print(f"[yellow]Warning: {name}={concurrency} is below 1; using 1.[/yellow]")
+        return 1
+    return concurrency
+
 # Global variables
 timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 log_file = os.path.join(log_dir, f"snapshot_log_{timestamp}.txt")
 summary_file = os.path.join(log_dir, f"snapshot_summary_{timestamp}.txt")
 snap_rid_list_file = os.path.join(log_dir, "snap_rid_list.txt")
 error_log_file = os.path.join(log_dir, f"error_log_{timestamp}.txt")
+compute_clients = {}
+log_queue = None
+rid_queue = None
+# Resource Graph pages hold 1000 rows; 500 IDs keep the query under Linux's 128KB per-argument limit
+graph_chunk_size = 500
+arm_endpoint = "https://management.azure.com"
+snapshot_api_version = "2023-04-02"
+# Concurrent ARM GETs for snapshots Resource Graph did not return
+show_concurrency = 16
+# Above this many snapshots the per-snapshot results table is written to CSV instead
+max_table_rows = 500
+# Concurrent snapshot creations allowed per subscription
+snap_concurrency = env_concurrency("SNAP_CONCURRENCY", 32)
+# JMESPath projection for az lock list, built once rather than per resource group
+lock_query = "[].{name:name, level:level}"
+
+@functools.cache
+def error_logger():
+    # Errors go through a queue to one long-lived file handler, so logging from the event loop never blocks on disk.
+    # The listener thread starts with the first error rather than at import
+    error_queue = queue.SimpleQueue()
+    handler = logging.FileHandler(error_log_file, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
+    listener = logging.handlers.QueueListener(error_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger = logging.getLogger("snapshot_errors")
+    logger.addHandler(logging.handlers.QueueHandler(error_queue))
+    logger.propagate = False
+    return logger
 
 def log_error(message):
-    with open(error_log_file, "a") as f:
-        f.write(f"{datetime.datetime.now()}: {message}\n")
-
-def write_detailed_log(message):
-    with open(log_file, "a") as f:
-        f.write(f"{datetime.datetime.now().isoformat()} - {message}\n")
-
-def write_snapshot_rid(snapshot_id):
-    with open(snap_rid_list_file, "a") as f:
-        f.write(f"{snapshot_id}\n")
-
-async def run_az_command_async(command, max_retries=3, delay=5):
-    for attempt in range(max_retries):
-        process = await asyncio.create_subprocess_shell(
-            command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        if process.returncode == 0:
-            return stdout.decode().strip(), stderr.decode().strip(), process.returncode
-        else:
-            write_detailed_log(f"Command failed (attempt {attempt + 1}): {command}")
-            write_detailed_log(f"Error: {stderr.decode().strip()}")
-            if attempt < max_retries - 1:
-                write_detailed_log(f"Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-    return "", stderr.decode().strip(), process.returncode
+    error_logger().error(message)
+
+async def write_detailed_log(message):
+    await log_queue.put(f"{datetime.datetime.now().isoformat()} - {message}\n")
+
+async def write_snapshot_rid(snapshot_id):
+    await rid_queue.put(f"{snapshot_id}\n")
+
+async def drain_queue_to_file(line_queue, path, max_batch=64, flush_interval=0.1):
+    # Single writer per file; queued lines are coalesced into one write and None stops the loop
+    loop = asyncio.get_running_loop()
+    async with aiofiles.open(path, "a") as f:
+        done = False
+        while not done:
+            batch = [await line_queue.get()]
+            deadline = loop.time() + flush_interval
+            while len(batch) < max_batch and batch[-1] is not None:
+                try:
+                    batch.append(await asyncio.wait_for(line_queue.get(), deadline - loop.time()))
+                except TimeoutError:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            if batch:
+                await f.write("".join(batch))
 
 def run_az_command(command):
     try:
@@ -70,11 +126,11 @@ def run_az_command(command):
             result = subprocess.run(command, check=True, capture_output=True, text=True)
             return result.stdout.strip()
         else:
-            with subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
-                stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                return f"Error: {stderr.strip()}"
-            return stdout.strip()
+            # Run az directly rather than through /bin/sh; shlex keeps the quoted --query intact
+            result = subprocess.run(shlex.split(command), capture_output=True, text=True)
+            if result.returncode != 0:
+                return f"Error: {result.stderr.strip()}"
+            return result.stdout.strip()
     except subprocess.CalledProcessError as e:
         logging.error(f"Command failed: {e.cmd}. Error: {e.stderr}")
         raise
@@ -90,9 +146,9 @@ def check_az_login():
             return False
         # Try to parse the JSON output
         try:
-            json.loads(result)
+            orjson.loads(result)
             return True
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             console.print(f"[red]Unexpected response from Azure CLI: {result}[/red]")
             return False
     except Exception as e:
@@ -103,7 +159,7 @@ def get_subscription_names():
     command = "az account list --query '[].{id:id, name:name}' -o json"
     result = run_az_command(command)
     if result and not result.startswith("Error:"):
-        subscriptions = json.loads(result)
+        subscriptions = orjson.loads(result)
         return {sub['id']: sub['name'] for sub in subscriptions}
     return {}
 
@@ -119,79 +175,114 @@ def switch_subscription(subscription, current_subscription):
     return current_subscription
 
 # Create Snapshot functions
-async def process_vm(resource_id, vm_name, chg_number):
-    write_detailed_log(f"Processing VM: {vm_name}")
-    write_detailed_log(f"Resource ID: {resource_id}")
-
-    # Get the subscription ID
-    subscription_id = resource_id.split("/")[2]
-    if not subscription_id:
-        write_detailed_log(f"Failed to get subscription ID for VM: {vm_name}")
-        return vm_name, "Failed to get subscription ID"
-
-    # Set the subscription ID
-    _, stderr, returncode = await run_az_command_async(f"az account set --subscription {subscription_id}")
-    if returncode != 0:
-        write_detailed_log(f"Failed to set subscription ID: {subscription_id}")
-        write_detailed_log(f"Error: {stderr}")
-        return vm_name, "Failed to set subscription ID"
-
-    write_detailed_log(f"Subscription ID: {subscription_id}")
-
-    # Get the disk ID of the VM's OS disk
-    stdout, stderr, returncode = await run_az_command_async(f"az vm show --ids {resource_id} --query 'storageProfile.osDisk.managedDisk.id' -o tsv")
-    if returncode != 0 or not stdout:
-        write_detailed_log(f"Failed to get disk ID for VM: {vm_name}")
-        write_detailed_log(f"Error: {stderr}")
-        return vm_name, "Failed to get disk ID"
-
-    disk_id = stdout
-
-    # Get the resource group name
-    stdout, stderr, returncode = await run_az_command_async(f"az vm show --ids {resource_id} --query 'resourceGroup' -o tsv")
-    if returncode != 0:
-        write_detailed_log(f"Failed to get resource group for VM: {vm_name}")
-        write_detailed_log(f"Error: {stderr}")
-        return vm_name, "Failed to get resource group"
+def get_compute_client(credential, subscription_id, http_session):
+    # One client per subscription, all riding on the run's aiohttp session so TLS connections are shared
+    if subscription_id not in compute_clients:
+        compute_clients[subscription_id] = ComputeManagementClient(
+            credential,
+            subscription_id,
+            transport=AioHttpTransport(session=http_session, session_owner=False),
+        )
+    return compute_clients[subscription_id]
 
-    resource_group = stdout
-    write_detailed_log(f"Resource group name: {resource_group}")
+async def list_vm_disks(client, resource_group, auth_failed):
+    # One paged list per resource group replaces a VM GET per VM
+    vm_disks = {}
+    try:
+        async for vm in client.virtual_machines.list(resource_group):
+            managed_disk = vm.storage_profile.os_disk.managed_disk
+            if managed_disk:
+                vm_disks[vm.id.lower()] = (managed_disk.id, vm.location)
+    except ClientAuthenticationError as e:
+        auth_failed.set()
+        await write_detailed_log(f"Authentication failed listing VMs in resource group: {resource_group} | Error: {e}")
+    except AzureError as e:
+        await write_detailed_log(f"Failed to list VMs in resource group: {resource_group} | Error: {e}")
+    return vm_disks
+
+async def process_vm(resource_id, vm_name, chg_number, client, vm_disks, auth_failed):
+    # Once Azure has rejected the credential for this subscription, further calls would fail the same way
+    if auth_failed.is_set():
+        return vm_name, "Failed: authentication rejected for subscription"
+
+    await write_detailed_log(f"Processing VM: {vm_name} | Resource ID: {resource_id}")
+
+    resource_group = resource_id.split("/")[4]
+
+    # Get the disk ID and location of the VM's OS disk
+    if resource_id.lower() not in vm_disks:
+        await write_detailed_log(f"Failed to get disk ID for VM: {vm_name}")
+        return vm_name, "Failed to get disk ID"
+    disk_id, location = vm_disks[resource_id.lower()]
 
     # Create a snapshot
     snapshot_name = f"RH_{chg_number}_{vm_name}_{timestamp}"
-    stdout, stderr, returncode = await run_az_command_async(f"az snapshot create --name {snapshot_name} --resource-group {resource_group} --source {disk_id}")
-    if returncode != 0:
-        write_detailed_log(f"Failed to create snapshot for VM: {vm_name}")
-        write_detailed_log(f"Error: {stderr}")
+    try:
+        poller = await client.snapshots.begin_create_or_update(
+            resource_group,
+            snapshot_name,
+            {"location": location, "creation_data": {"create_option": "Copy", "source_resource_id": disk_id}},
+        )
+        snapshot = await poller.result()
+    except ClientAuthenticationError as e:
+        auth_failed.set()
+        await write_detailed_log(f"Authentication failed creating snapshot for VM: {vm_name} | Error: {e}")
+        return vm_name, "Failed: authentication rejected for subscription"
+    except AzureError as e:
+        await write_detailed_log(f"Failed to create snapshot for VM: {vm_name} | Error: {e}")
         return vm_name, "Failed to create snapshot"
 
-    # Write snapshot details to log file
-    write_detailed_log(f"Snapshot created: {snapshot_name}")
-    try:
-        snapshot_data = json.loads(stdout)
-        write_detailed_log(json.dumps(snapshot_data, indent=2))
-        
-        # Extract snapshot ID and write to snap_rid_list.txt
-        snapshot_id = snapshot_data.get('id')
-        if snapshot_id:
-            write_snapshot_rid(snapshot_id)
-            write_detailed_log(f"Snapshot resource ID added to snap_rid_list.txt: {snapshot_id}")
-        else:
-            write_detailed_log(f"Warning: Could not extract snapshot resource ID for {snapshot_name}")
-    except json.JSONDecodeError:
-        write_detailed_log(f"Warning: Could not parse snapshot creation output as JSON. Raw output:")
-        write_detailed_log(stdout)
+    # Write snapshot details to log file as one entry
+    message = f"Snapshot created: {snapshot_name}\n{orjson.dumps(snapshot.as_dict(), option=orjson.OPT_INDENT_2).decode()}\n"
+
+    # Write snapshot ID to snap_rid_list.txt
+    if snapshot.id:
+        await write_snapshot_rid(snapshot.id)
+        message += f"Snapshot resource ID added to snap_rid_list.txt: {snapshot.id}\n"
+    else:
+        message += f"Warning: Could not extract snapshot resource ID for {snapshot_name}\n"
 
-    write_detailed_log(f"Snapshot created successfully for VM: {vm_name}")
+    await write_detailed_log(f"{message}Snapshot created successfully for VM: {vm_name}")
     return vm_name, snapshot_name
 
+async def snapshot_subscription(subscription_id, vms, chg_number, credential, http_session, progress, task):
+    client = get_compute_client(credential, subscription_id, http_session)
+    await write_detailed_log(f"Subscription ID: {subscription_id}")
+
+    # Look up every OS disk in the subscription's resource groups before creating anything
+    auth_failed = asyncio.Event()
+    vm_disks = {}
+    for disks in await asyncio.gather(*[
+        list_vm_disks(client, resource_group, auth_failed)
+        for resource_group in {resource_id.split("/")[4] for resource_id, _ in vms}
+    ]):
+        vm_disks.update(disks)
+
+    if auth_failed.is_set():
+        console.print(f"[red]Authentication failed for subscription {subscription_id}; skipping its {len(vms)} VMs[/red]")
+        progress.update(task, advance=len(vms))
+        return [(vm_name, "Failed: authentication rejected for subscription") for _, vm_name in vms]
+
+    # VMs in a subscription run concurrently, bounded by a semaphore of their own
+    semaphore = asyncio.Semaphore(snap_concurrency)
+
+    async def snapshot_vm(resource_id, vm_name):
+        async with semaphore:
+            result = await process_vm(resource_id, vm_name, chg_number, client, vm_disks, auth_failed)
+        progress.update(task, advance=1)
+        return result
+
+    return await asyncio.gather(*[snapshot_vm(resource_id, vm_name) for resource_id, vm_name in vms])
+
 async def create_snapshots():
+    global log_queue, rid_queue
+
     console.print("[cyan]Azure Snapshot Creation[/cyan]")
     console.print("=========================")
 
     chg_number = Prompt.ask("Enter the CHG number")
-    with open(log_file, "a") as f:
-        f.write(f"CHG Number: {chg_number}\n\n")
+    async with aiofiles.open(log_file, "a") as f:
+        await f.write(f"CHG Number: {chg_number}\n\n")
 
     try:
         with open("snapshot_vmlist.txt") as file:
@@ -212,20 +303,57 @@ async def create_snapshots():
     successful_snapshots = []
     failed_snapshots = []
 
-    with Live(Panel(progress), refresh_per_second=4) as live:
+    # Fresh queues per run, since each menu choice runs in its own event loop
+    log_queue = asyncio.Queue()
+    rid_queue = asyncio.Queue()
+    writers = [
+        asyncio.create_task(drain_queue_to_file(log_queue, log_file)),
+        asyncio.create_task(drain_queue_to_file(rid_queue, snap_rid_list_file)),
+    ]
+    try:
+        grouped_vms = defaultdict(list)
         for line in vm_list:
+            # Inventory rows may carry the OS disk ID and location after the VM name; this path looks them up itself
             try:
-                resource_id, vm_name = line.split()
-                result = await process_vm(resource_id, vm_name, chg_number)
-                if isinstance(result[1], str) and not result[1].startswith("Failed"):
-                    successful_snapshots.append(result)
-                else:
-                    failed_snapshots.append(result)
+                resource_id, vm_name = line.split()[:2]
             except ValueError:
-                write_detailed_log(f"Error: Invalid line format in snapshot_vmlist.txt: {line}")
+                await write_detailed_log(f"Error: Invalid line format in snapshot_vmlist.txt: {line}")
                 failed_snapshots.append((line, "Invalid line format"))
-            progress.update(task, advance=1)
-            live.update(Panel(progress))
+                progress.update(task, advance=1)
+                continue
+            # The resource ID carries the subscription, resource group and VM name
+            parts = resource_id.split("/")
+            if len(parts) < 9 or not parts[2]:
+                await write_detailed_log(f"Failed to get subscription ID for VM: {vm_name}")
+                failed_snapshots.append((vm_name, "Failed to get subscription ID"))
+                progress.update(task, advance=1)
+                continue
+            grouped_vms[parts[2]].append((resource_id, vm_name))
+
+        # Keep idle connections longer than aiohttp's 15s default so lulls between calls don't force new handshakes
+        connector = aiohttp.TCPConnector(limit=64, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector) as http_session, DefaultAzureCredential() as credential:
+            try:
+                with Live(Panel(progress), refresh_per_second=4):
+                    subscription_results = await asyncio.gather(*[
+                        snapshot_subscription(subscription_id, vms, chg_number, credential, http_session, progress, task)
+                        for subscription_id, vms in grouped_vms.items()
+                    ])
+            finally:
+                for client in compute_clients.values():
+                    await client.close()
+                compute_clients.clear()
+    finally:
+        for line_queue in (log_queue, rid_queue):
+            await line_queue.put(None)
+        await asyncio.gather(*writers)
+
+    for results in subscription_results:
+        for result in results:
+            if isinstance(result[1], str) and not result[1].startswith("Failed"):
+                successful_snapshots.append(result)
+            else:
+                failed_snapshots.append(result)
 
     # Create summary table
     table = Table(title="Snapshot Creation Summary")
@@ -238,21 +366,23 @@ async def create_snapshots():
 
     console.print(table)
 
-    # Write summary to file
+    # Write summary to file in one write
+    summary = [
+        "Snapshot Creation Summary",
+        "========================",
+        "",
+        f"Total VMs processed: {total_vms}",
+        f"Successful snapshots: {len(successful_snapshots)}",
+        f"Failed snapshots: {len(failed_snapshots)}",
+        "",
+        "Successful snapshots:",
+        *(f"- {vm}: {snapshot}" for vm, snapshot in successful_snapshots),
+        "",
+        "Failed snapshots:",
+        *(f"- {vm}: {error}" for vm, error in failed_snapshots),
+    ]
     with open(summary_file, "w") as f:
-        f.write("Snapshot Creation Summary\n")
-        f.write("========================\n\n")
-        f.write(f"Total VMs processed: {total_vms}\n")
-        f.write(f"Successful snapshots: {len(successful_snapshots)}\n")
-        f.write(f"Failed snapshots: {len(failed_snapshots)}\n\n")
-
-        f.write("Successful snapshots:\n")
-        for vm, snapshot in successful_snapshots:
-            f.write(f"- {vm}: {snapshot}\n")
-
-        f.write("\nFailed snapshots:\n")
-        for vm, error in failed_snapshots:
-            f.write(f"- {vm}: {error}\n")
+        f.write("\n".join(summary) + "\n")
 
     console.print("\n[bold green]Snapshot creation process completed.[/bold green]")
     console.print(f"Detailed log: {log_file}")
@@ -260,6 +390,121 @@ async def create_snapshots():
     console.print(f"Snapshot resource IDs: {snap_rid_list_file}")
 
 # Validate Snapshot functions
+@dataclass(frozen=True, slots=True)
+class SnapshotResult:
+    id: str
+    exists: bool = False
+    # False when the lookup could not say either way, e.g. ARM rejected the login
+    validated: bool = True
+    name: str = 'N/A'
+    resource_group: str = 'N/A'
+    time_created: str = 'N/A'
+    size_gb: int | str = 'N/A'
+    state: str = 'N/A'
+
+def bulk_query(snapshot_ids):
+    query = (
+        "Resources | where type =~ 'microsoft.compute/snapshots' and id in~ ("
+        + ",".join(f"'{snapshot_id}'" for snapshot_id in snapshot_ids)
+        + ") | project id, name, resourceGroup, timeCreated=properties.timeCreated,"
+        " diskSizeGb=properties.diskSizeGB, provisioningState=properties.provisioningState"
+    )
+    try:
+        result = subprocess.run(
+            ["az", "graph", "query", "-q", query, "--first", str(len(snapshot_ids)), "-o", "json"],
+            capture_output=True, check=True
+        )
+        # orjson takes the raw bytes, so the output is never decoded to str
+        rows = orjson.loads(result.stdout)
+    except subprocess.CalledProcessError as e:
+        log_error(f"Resource Graph query failed: {e.stderr.decode(errors='replace')}")
+        return None
+    except orjson.JSONDecodeError:
+        log_error("Failed to parse Resource Graph output")
+        return None
+    # Newer az versions wrap the rows as {"data": [...]}
+    if isinstance(rows, dict):
+        rows = rows.get('data', [])
+    return {row['id'].lower(): row for row in rows}
+
+async def get_snapshot(session, semaphore, auth_failed, snapshot_id, max_retries=4, base_delay=1.0, max_delay=30, jitter=1.0):
+    # Returns ("found", details), ("missing", None) or ("unvalidated", None)
+    async with semaphore:
+        for attempt in range(max_retries):
+            # Once ARM rejects the token, every later request would be rejected the same way
+            if auth_failed.is_set():
+                return "unvalidated", None
+            retry_after = None
+            try:
+                async with session.get(f"{arm_endpoint}{snapshot_id}?api-version={snapshot_api_version}") as response:
+                    if response.status == 200:
+                        body = orjson.loads(await response.read())
+                        properties = body.get('properties', {})
+                        # Same shape as a Resource Graph row
+                        return "found", {
+                            'name': body.get('name'),
+                            'resourceGroup': body.get('id', snapshot_id).split('/')[4],
+                            'timeCreated': properties.get('timeCreated'),
+                            'diskSizeGb': properties.get('diskSizeGB'),
+                            'provisioningState': properties.get('provisioningState')
+                        }
+                    if response.status in (400, 404):
+                        return "missing", None
+                    if response.status == 401:
+                        auth_failed.set()
+                        log_error(f"ARM rejected the token for snapshot: {snapshot_id}\nError: {await response.text()}")
+                        return "unvalidated", None
+                    if response.status == 403:
+                        log_error(f"Not authorized to read snapshot: {snapshot_id}\nError: {await response.text()}")
+                        return "unvalidated", None
+                    log_error(f"ARM returned {response.status} for snapshot: {snapshot_id} (attempt {attempt + 1})")
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log_error(f"Request failed for snapshot: {snapshot_id} (attempt {attempt + 1})\nError: {e!r}")
+            if attempt < max_retries - 1:
+                # Jitter keeps throttled lookups from retrying in lockstep; ARM's Retry-After is a floor
+                delay = min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                await asyncio.sleep(delay)
+    return "unvalidated", None
+
+async def show_snapshots(snapshot_ids, progress, task):
+    # Returns the details of snapshots found and the IDs that could not be validated either way.
+    # One token and one keep-alive pool for every lookup instead of an az process per snapshot
+    try:
+        async with DefaultAzureCredential() as credential:
+            token = await credential.get_token(f"{arm_endpoint}/.default")
+    except ClientAuthenticationError as e:
+        log_error(f"Failed to get an ARM token: {e}")
+        console.print("[yellow]Could not get an Azure token; snapshots that needed an ARM lookup are not validated. Please run 'az login' and try again.[/yellow]")
+        progress.update(task, advance=len(snapshot_ids))
+        return {}, list(snapshot_ids)
+
+    semaphore = asyncio.Semaphore(show_concurrency)
+    auth_failed = asyncio.Event()
+    connector = aiohttp.TCPConnector(limit=show_concurrency, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector, headers={"Authorization": f"Bearer {token.token}"}) as session:
+        async def show(snapshot_id):
+            result = await get_snapshot(session, semaphore, auth_failed, snapshot_id)
+            progress.update(task, advance=1)
+            return result
+
+        # If one lookup raises, the group cancels the rest instead of leaving them running
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(show(snapshot_id)) for snapshot_id in snapshot_ids]
+    if auth_failed.is_set():
+        console.print("[bold red]Azure rejected the login; some snapshots are not validated. Please run 'az login' and try again.[/bold red]")
+    found = {}
+    unvalidated = []
+    for snapshot_id, task in zip(snapshot_ids, tasks):
+        status, details = task.result()
+        if status == "found":
+            found[snapshot_id.lower()] = details
+        elif status == "unvalidated":
+            unvalidated.append(snapshot_id)
+    return found, unvalidated
+
 def validate_snapshots():
     console.print("[cyan]Azure Snapshot Validation[/cyan]")
     console.print("===========================")
@@ -279,7 +524,7 @@ def validate_snapshots():
 
     try:
         with open(snapshot_list_file, "r") as file:
-            snapshot_ids = file.read().splitlines()
+            snapshot_ids = [line.strip() for line in file if line.strip()]
     except FileNotFoundError:
         console.print(f"[bold red]Error: File '{snapshot_list_file}' not found.[/bold red]")
         return
@@ -292,85 +537,142 @@ def validate_snapshots():
         return
 
     total_snapshots = len(snapshot_ids)
-    validated_snapshots = []
-
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Validating snapshots...", total=total_snapshots)
-
-        for snapshot_id in snapshot_ids:
-            snapshot_info = {'id': snapshot_id, 'exists': False}
+    # Look each snapshot up once however often it is listed; ARM IDs are case-insensitive
+    first_seen = {}
+    for snapshot_id in snapshot_ids:
+        first_seen.setdefault(snapshot_id.lower(), snapshot_id)
+    unique_ids = list(first_seen.values())
+    details_by_id = {}
+    unvalidated = set()
+
+    # One bar for the whole run, redrawn at the same 4Hz as the create path's display
+    with Progress(refresh_per_second=4) as progress:
+        task = progress.add_task("[cyan]Validating snapshots...", total=len(unique_ids))
+        misses = []
+
+        for start in range(0, len(unique_ids), graph_chunk_size):
+            chunk = unique_ids[start:start + graph_chunk_size]
+
+            found = bulk_query(chunk)
+
+            for snapshot_id in chunk:
+                key = snapshot_id.lower()
+                details = found.get(key) if found is not None else None
+                if details is None:
+                    misses.append(snapshot_id)
+                    continue
+                details_by_id[key] = details
+                progress.update(task, advance=1)
 
-            details = run_az_command(f"az snapshot show --ids {snapshot_id} --query '{{name:name, resourceGroup:resourceGroup, timeCreated:timeCreated, diskSizeGb:diskSizeGb, provisioningState:provisioningState}}' -o json")
+        # Resource Graph can lag behind newly created snapshots, so confirm misses directly
+        if misses:
+            confirmed, not_validated = asyncio.run(show_snapshots(misses, progress, task))
+            details_by_id.update(confirmed)
+            unvalidated.update(snapshot_id.lower() for snapshot_id in not_validated)
 
-            if details and not details.startswith("Error:"):
-                try:
-                    details = json.loads(details)
-                    snapshot_info.update({
-                        'exists': True,
-                        'name': details['name'],
-                        'resource_group': details['resourceGroup'],
-                        'time_created': details['timeCreated'],
-                        'size_gb': details['diskSizeGb'],
-                        'state': details['provisioningState']
-                    })
-                except json.JSONDecodeError:
-                    log_error(f"Failed to parse JSON for snapshot: {snapshot_id}")
-
-            validated_snapshots.append(snapshot_info)
-            progress.update(task, advance=1)
+    validated_snapshots = []
+    existing_count = 0
+    unvalidated_count = 0
+    for snapshot_id in snapshot_ids:
+        details = details_by_id.get(snapshot_id.lower())
+        if snapshot_id.lower() in unvalidated:
+            unvalidated_count += 1
+            validated_snapshots.append(SnapshotResult(id=snapshot_id, validated=False, state='Not validated'))
+        elif details:
+            existing_count += 1
+            validated_snapshots.append(SnapshotResult(
+                id=snapshot_id,
+                exists=True,
+                name=details['name'],
+                resource_group=details['resourceGroup'],
+                time_created=details['timeCreated'],
+                size_gb=details['diskSizeGb'],
+                state=details['provisioningState']
+            ))
+        else:
+            validated_snapshots.append(SnapshotResult(id=snapshot_id))
+    missing_count = total_snapshots - existing_count - unvalidated_count
 
     end_time = time.time()
     runtime = end_time - start_time
 
-    # Create summary table
-    table = Table(title="Snapshot Validation Summary")
-    table.add_column("Snapshot ID", style="cyan", no_wrap=False)
-    table.add_column("Name", style="cyan")
-    table.add_column("Exists", style="green")
-    table.add_column("Resource Group", style="magenta")
-    table.add_column("Time Created", style="yellow")
-    table.add_column("Size (GB)", style="blue")
-    table.add_column("State", style="red")
-
-    for snapshot in validated_snapshots:
-        table.add_row(
-            snapshot['id'],
-            snapshot.get('name', 'N/A'),
-            "✅" if snapshot['exists'] else "❌",
-            snapshot.get('resource_group', 'N/A'),
-            snapshot.get('time_created', 'N/A'),
-            str(snapshot.get('size_gb', 'N/A')),
-            snapshot.get('state', 'N/A')
-        )
-
-    console.print(table)
+    if total_snapshots > max_table_rows:
+        # Rich lays out every row before drawing, so large runs go to a CSV instead of the console
+        csv_file = os.path.join(log_dir, f"snapshot_validation_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+        with open(csv_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Snapshot ID", "Name", "Exists", "Resource Group", "Time Created", "Size (GB)", "State"])
+            writer.writerows(
+                (
+                    snapshot.id,
+                    snapshot.name,
+                    "Yes" if snapshot.exists else "No" if snapshot.validated else "Unknown",
+                    snapshot.resource_group,
+                    snapshot.time_created,
+                    snapshot.size_gb,
+                    snapshot.state
+                )
+                for snapshot in validated_snapshots
+            )
+        console.print(f"[yellow]Too many snapshots to list here; per-snapshot results were written to {csv_file}[/yellow]")
+    else:
+        # Create summary table
+        table = Table(title="Snapshot Validation Summary")
+        table.add_column("Snapshot ID", style="cyan", no_wrap=False)
+        table.add_column("Name", style="cyan")
+        table.add_column("Exists", style="green")
+        table.add_column("Resource Group", style="magenta")
+        table.add_column("Time Created", style="yellow")
+        table.add_column("Size (GB)", style="blue")
+        table.add_column("State", style="red")
+
+        for snapshot in validated_snapshots:
+            table.add_row(
+                snapshot.id,
+                snapshot.name,
+                "✅" if snapshot.exists else "❌" if snapshot.validated else "❔",
+                snapshot.resource_group,
+                snapshot.time_created,
+                str(snapshot.size_gb),
+                snapshot.state
+            )
+
+        console.print(table)
 
     console.print(f"[bold green]Validation complete![/bold green]")
     console.print(f"Total snapshots processed: {total_snapshots}")
-    console.print(f"Existing snapshots: {sum(1 for s in validated_snapshots if s['exists'])}")
-    console.print(f"Missing snapshots: {sum(1 for s in validated_snapshots if not s['exists'])}")
+    console.print(f"Existing snapshots: {existing_count}")
+    console.print(f"Missing snapshots: {missing_count}")
+    if unvalidated_count:
+        console.print(f"[yellow]Not validated: {unvalidated_count}[/yellow]")
     console.print(f"Runtime: {runtime:.2f} seconds")
 
     if Confirm.ask("Do you want to save the validation results to a log file?"):
         timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
         log_file = os.path.join(log_dir, f"snapshot_validation_log_{timestamp}.txt")
+        lines = ["Snapshot Validation Results", "===========================", ""]
+        for snapshot in validated_snapshots:
+            lines.append(f"Snapshot ID: {snapshot.id}")
+            lines.append(f"Exists: {'Yes' if snapshot.exists else 'No' if snapshot.validated else 'Unknown (not validated)'}")
+            if snapshot.exists:
+                lines.extend([
+                    f"Name: {snapshot.name}",
+                    f"Resource Group: {snapshot.resource_group}",
+                    f"Time Created: {snapshot.time_created}",
+                    f"Size (GB): {snapshot.size_gb}",
+                    f"State: {snapshot.state}",
+                ])
+            lines.append("")
+        lines.extend([
+            "",
+            f"Total snapshots processed: {total_snapshots}",
+            f"Existing snapshots: {existing_count}",
+            f"Missing snapshots: {missing_count}",
+            f"Not validated: {unvalidated_count}",
+            f"Runtime: {runtime:.2f} seconds",
+        ])
         with open(log_file, "w") as f:
-            f.write("Snapshot Validation Results\n")
-            f.write("===========================\n\n")
-            for snapshot in validated_snapshots:
-                f.write(f"Snapshot ID: {snapshot['id']}\n")
-                f.write(f"Exists: {'Yes' if snapshot['exists'] else 'No'}\n")
-                if snapshot['exists']:
-                    f.write(f"Name: {snapshot.get('name', 'N/A')}\n")
-                    f.write(f"Resource Group: {snapshot.get('resource_group', 'N/A')}\n")
-                    f.write(f"Time Created: {snapshot.get('time_created', 'N/A')}\n")
-                    f.write(f"Size (GB): {snapshot.get('size_gb', 'N/A')}\n")
-                    f.write(f"State: {snapshot.get('state', 'N/A')}\n")
-                f.write("\n")
-            f.write(f"\nTotal snapshots processed: {total_snapshots}\n")
-            f.write(f"Existing snapshots: {sum(1 for s in validated_snapshots if s['exists'])}\n")
-            f.write(f"Missing snapshots: {sum(1 for s in validated_snapshots if not s['exists'])}\n")        
-            f.write(f"Runtime: {runtime:.2f} seconds\n")
+            f.write("\n".join(lines) + "\n")
         console.print(f"[bold green]Log file saved:[/bold green] {log_file}")
 
     console.print(f"\n[yellow]Note: Errors and details have been logged to: {error_log_file}[/yellow]")
@@ -389,8 +691,8 @@ def check_and_remove_scope_locks(resource_groups):
     current_subscription = None
     for subscription_id, resource_group in resource_groups:
         current_subscription = switch_subscription(subscription_id, current_subscription)
-        command = f"az lock list --resource-group {resource_group} --query '[].{{name:name, level:level}}' -o json"
-        locks = json.loads(run_az_command(command))
+        command = f"az lock list --resource-group {resource_group} --query '{lock_query}' -o json"
+        locks = orjson.loads(run_az_command(command))
         for lock in locks:
             if lock['level'] == 'CanNotDelete':
                 remove_command = f"az lock delete --name {lock['name']} --resource-group {resource_group}"  
@@ -416,31 +718,6 @@ def restore_scope_locks(removed_locks):
             console.print(f"[red]Failed to restore lock '{lock_name}' to resource group '{resource_group}': {result}[/red]")
     return restored_locks
 
-def check_snapshot_exists(snapshot_id):
-    command = f"az snapshot show --ids {snapshot_id}"
-    result = run_az_command(command)
-    return not result.startswith("Error:")
-
-def process_snapshot(snapshot_id, subscription_names):
-    try:
-        parts = snapshot_id.split('/')
-        if len(parts) < 9:
-            logging.error(f"Invalid snapshot ID format: {snapshot_id}")
-            return None, "invalid", (snapshot_id, "Invalid snapshot ID format")
-
-        subscription_id = parts[2]
-        subscription_name = subscription_names.get(subscription_id, subscription_id)
-        snapshot_name = parts[-1]
-
-        # Check if snapshot exists
-        if not check_snapshot_exists(snapshot_id):
-            return subscription_name, "non-existent", snapshot_name
-
-        return subscription_name, "valid", snapshot_name
-    except Exception as e:
-        logging.error(f"Error processing snapshot {snapshot_id}: {str(e)}")
-        return None, "error", (snapshot_id, str(e))
-
 def delete_snapshot(snapshot_id):
     command = f"az snapshot delete --ids {snapshot_id}"
     result = run_az_command(command)
@@ -452,20 +729,32 @@ def pre_validate_snapshots(snapshot_ids, subscription_names):
 
     with Progress() as progress:
         task = progress.add_task("[cyan]Pre-validating snapshots...", total=len(snapshot_ids))
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_snapshot = {executor.submit(process_snapshot, snapshot_id, subscription_names): snapshot_id for snapshot_id in snapshot_ids}
-            for future in as_completed(future_to_snapshot):
-                try:
-                    subscription_name, status, data = future.result()
-                    if subscription_name:
-                        results[subscription_name][status].append(data)
-                        if status == "valid":
-                            valid_snapshots.append(future_to_snapshot[future])
-                    else:
-                        results["Unknown"][status].append(data)
-                except Exception as e:
-                    logging.error(f"Error processing future: {str(e)}")
+
+        well_formed_ids = []
+        for snapshot_id in snapshot_ids:
+            if len(snapshot_id.split('/')) < 9:
+                logging.error(f"Invalid snapshot ID format: {snapshot_id}")
+                results["Unknown"]["invalid"].append((snapshot_id, "Invalid snapshot ID format"))
                 progress.update(task, advance=1)
+            else:
+                well_formed_ids.append(snapshot_id)
+
+        # One token and one connection pool for the whole list instead of an az process per snapshot
+        existing, unvalidated = asyncio.run(show_snapshots(well_formed_ids, progress, task)) if well_formed_ids else ({}, [])
+    unvalidated = {snapshot_id.lower() for snapshot_id in unvalidated}
+
+    for snapshot_id in well_formed_ids:
+        parts = snapshot_id.split('/')
+        subscription_name = subscription_names.get(parts[2], parts[2])
+        snapshot_name = parts[-1]
+        if snapshot_id.lower() in existing:
+            results[subscription_name]["valid"].append(snapshot_name)
+            valid_snapshots.append(snapshot_id)
+        elif snapshot_id.lower() in unvalidated:
+            # Not deleted, and not reported as non-existent when the lookup could not tell
+            results[subscription_name]["error"].append((snapshot_name, "Could not validate snapshot"))
+        else:
+            results[subscription_name]["non-existent"].append(snapshot_name)
 
     return valid_snapshots, results
 
@@ -581,7 +870,7 @@ def delete_snapshots():
 
     try:
         with open(filename, 'r') as f:
-            snapshot_ids = f.read().splitlines()
+            snapshot_ids = [line.strip() for line in f if line.strip()]
     except Exception as e:
         console.print(f"[bold red]Error reading file {filename}: {e}[/bold red]")
         return
@@ -651,10 +940,6 @@ def main_menu():
         
         input("\nPress Enter to continue...")
 
-import subprocess
-import sys
-import shutil
-
 def check_az_cli():
     try:
         # Check if 'az' command is available
@@ -666,7 +951,7 @@ def check_az_cli():
         try:
             version_result = subprocess.run(["az", "version", "--output", "json"], capture_output=True, text=True, timeout=10)
             if version_result.returncode == 0:
-                version_info = json.loads(version_result.stdout)
+                version_info = orjson.loads(version_result.stdout)
                 azure_cli_version = version_info.get('azure-cli', 'Unknown')
                 azure_cli_core_version = version_info.get('azure-cli-core', 'Unknown')
                 azure_cli_telemetry_version = version_info.get('azure-cli-telemetry', 'Unknown')
@@ -678,7 +963,7 @@ def check_az_cli():
                 console.print("[yellow]Warning: Unable to get Azure CLI version. Attempting to proceed anyway.[/yellow]")
         except subprocess.TimeoutExpired:
             console.print("[yellow]Warning: Azure CLI version check timed out. Attempting to proceed anyway.[/yellow]")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             console.print("[yellow]Warning: Failed to parse Azure CLI version information. Attempting to proceed anyway.[/yellow]")
         except Exception as e:
             console.print(f"[yellow]Warning: Unexpected error while checking Azure CLI version: {str(e)}. Attempting to proceed anyway.[/yellow]")
@@ -1,3 +1,4 @@
+import os
 import json
 import subprocess
 import csv
@@ -22,7 +23,7 @@ def get_subscriptions(console):
 def get_linux_vms(console):
     command = [
         'az', 'vm', 'list',
-        '--query', "[?storageProfile.osDisk.osType=='Linux'].{SubscriptionId:id, Name:name}",
+        '--query', "[?storageProfile.osDisk.osType=='Linux'].{SubscriptionId:id, Name:name, DiskId:storageProfile.osDisk.managedDisk.id, Location:location}",
         '-o', 'json'
     ]
     
@@ -37,11 +38,17 @@ def get_linux_vms(console):
     return vms
 
 def write_to_csv(vms, console, filename='linux_vm-inventory.csv'):
-    with open(filename, mode='w', newline='') as file:
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, mode='w', newline='') as file:
         writer = csv.writer(file, delimiter='\t')  # Use tab as delimiter
-        writer.writerow(['Subscription ID,VM Name/Hostname'])  # Header row
-        for vm in vms:
-            writer.writerow([f"{vm['SubscriptionId']} {vm['Name']}"])  # Use space between ID and Name
+        writer.writerow(['Subscription ID,VM Name/Hostname,OS Disk ID,Location'])  # Header row
+        # Use space between fields; VMs without a managed OS disk get no disk/location columns so consumers look them up
+        writer.writerows(
+            [f"{vm['SubscriptionId']} {vm['Name']} {vm['DiskId']} {vm['Location']}" if vm['DiskId'] else f"{vm['SubscriptionId']} {vm['Name']}"]
+            for vm in vms
+        )
+    # Swap in the new inventory only once it is fully written
+    os.replace(tmp_filename, filename)
     console.print(f"[bold green]VM inventory has been written to {filename}[/bold green]")
 
 def main():
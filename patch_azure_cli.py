@@ -1,5 +1,7 @@
 import os
 import sys
+import mmap
+import sysconfig
 import subprocess
 
 def check_azure_cli_installed():
@@ -19,20 +21,30 @@ def install_azure_cli():
         sys.exit(1)
 
 def patch_azure_cli():
-    site_packages = next(p for p in sys.path if 'site-packages' in p)
+    # purelib is the site-packages of the running interpreter, including inside a venv
+    site_packages = sysconfig.get_paths()['purelib']
     file_to_patch = os.path.join(site_packages, 'azure', 'cli', 'core', 'extension', '__init__.py')
-    
+
+    # Scan the file without decoding it and skip the rewrite when there is nothing to patch
+    with open(file_to_patch, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm.find(b"def get_python_lib():") != -1:
+            print("Azure CLI is already patched.")
+            return
+        if mm.find(b"from distutils.sysconfig import get_python_lib") == -1:
+            print("Azure CLI does not need patching.")
+            return
+
     with open(file_to_patch, 'r') as f:
         content = f.read()
-    
+
     patched_content = content.replace(
         "from distutils.sysconfig import get_python_lib",
         "import sysconfig\n\ndef get_python_lib():\n    return sysconfig.get_path('purelib')"
     )
-    
+
     with open(file_to_patch, 'w') as f:
         f.write(patched_content)
-    
+
     print("Azure CLI patched successfully.")
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 import os
 import time
 import subprocess
-import json
+import shlex
+import orjson
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from collections import defaultdict
 from rich.console import Console
@@ -19,17 +20,20 @@ console = Console()
 logging.basicConfig(filename='azure_manager.log', level=logging.DEBUG,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
+# JMESPath projection for az lock list, built once rather than per resource group
+lock_query = "[].{name:name, level:level}"
+
 def run_az_command(command):
     try:
         if isinstance(command, list):
             result = subprocess.run(command, check=True, capture_output=True, text=True)
             return result.stdout.strip()
         else:
-            with subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
-                stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                return f"Error: {stderr.strip()}"
-            return stdout.strip()
+            # Run az directly rather than through /bin/sh; shlex keeps the quoted --query intact
+            result = subprocess.run(shlex.split(command), capture_output=True, text=True)
+            if result.returncode != 0:
+                return f"Error: {result.stderr.strip()}"
+            return result.stdout.strip()
     except subprocess.CalledProcessError as e:
         logging.error(f"Command failed: {e.cmd}. Error: {e.stderr}")
         raise
@@ -52,7 +56,7 @@ def get_subscription_names():
     command = "az account list --query '[].{id:id, name:name}' -o json"
     result = run_az_command(command)
     if result and not result.startswith("Error:"):
-        subscriptions = json.loads(result)
+        subscriptions = orjson.loads(result)
         return {sub['id']: sub['name'] for sub in subscriptions}
     return {}
 
@@ -80,8 +84,8 @@ def check_and_remove_scope_locks(resource_groups):
     current_subscription = None
     for subscription_id, resource_group in resource_groups:
         current_subscription = switch_subscription(subscription_id, current_subscription)
-        command = f"az lock list --resource-group {resource_group} --query '[].{{name:name, level:level}}' -o json"
-        locks = json.loads(run_az_command(command))
+        command = f"az lock list --resource-group {resource_group} --query '{lock_query}' -o json"
+        locks = orjson.loads(run_az_command(command))
         for lock in locks:
             if lock['level'] == 'CanNotDelete':
                 remove_command = f"az lock delete --name {lock['name']} --resource-group {resource_group}"  
@@ -107,30 +111,35 @@ def restore_scope_locks(removed_locks):
             console.print(f"[red]Failed to restore lock '{lock_name}' to resource group '{resource_group}': {result}[/red]")
     return restored_locks
 
-def check_snapshot_exists(snapshot_id):
-    command = f"az snapshot show --ids {snapshot_id}"
-    result = run_az_command(command)
-    return not result.startswith("Error:")
-
-def process_snapshot(snapshot_id, subscription_names):
-    try:
-        parts = snapshot_id.split('/')
-        if len(parts) < 9:
-            logging.error(f"Invalid snapshot ID format: {snapshot_id}")
-            return None, "invalid", (snapshot_id, "Invalid snapshot ID format")
-
-        subscription_id = parts[2]
-        subscription_name = subscription_names.get(subscription_id, subscription_id)
-        snapshot_name = parts[-1]
-
-        # Check if snapshot exists
-        if not check_snapshot_exists(snapshot_id):
-            return subscription_name, "non-existent", snapshot_name
-
-        return subscription_name, "valid", snapshot_name
-    except Exception as e:
-        logging.error(f"Error processing snapshot {snapshot_id}: {str(e)}")
-        return None, "error", (snapshot_id, str(e))
+def batched_az(op, ids, chunk_size=50, extra_args=(), max_workers=4):
+    # One az process per chunk of IDs instead of one per ID; chunks run concurrently.
+    # Output stays as bytes, which orjson parses without a separate decode
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_chunk = {
+            executor.submit(subprocess.run, ["az", *op.split(), "--ids", *chunk, *extra_args], capture_output=True): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(future_to_chunk):
+            yield future_to_chunk[future], future.result()
+
+def parse_snapshot_ids(stdout):
+    # A single-ID call prints an object, a multi-ID call prints a list
+    if not stdout.strip():
+        return set()
+    details = orjson.loads(stdout)
+    if isinstance(details, dict):
+        details = [details]
+    return {snapshot['id'].lower() for snapshot in details if snapshot}
+
+def show_snapshot_status(snapshot_id):
+    result = run_az_command(f"az snapshot show --ids {snapshot_id}")
+    if not result.startswith("Error:"):
+        return "valid", None
+    # Only a definite not-found means non-existent; throttling or an expired login is an error
+    if "ResourceNotFound" in result or "was not found" in result:
+        return "non-existent", None
+    return "error", result[len("Error: "):]
 
 def delete_snapshot(snapshot_id):
     command = f"az snapshot delete --ids {snapshot_id}"
@@ -143,20 +152,48 @@ def pre_validate_snapshots(snapshot_ids, subscription_names):
 
     with Progress() as progress:
         task = progress.add_task("[cyan]Pre-validating snapshots...", total=len(snapshot_ids))
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_snapshot = {executor.submit(process_snapshot, snapshot_id, subscription_names): snapshot_id for snapshot_id in snapshot_ids}
-            for future in as_completed(future_to_snapshot):
-                try:
-                    subscription_name, status, data = future.result()
-                    if subscription_name:
-                        results[subscription_name][status].append(data)
-                        if status == "valid":
-                            valid_snapshots.append(future_to_snapshot[future])
-                    else:
-                        results["Unknown"][status].append(data)
-                except Exception as e:
-                    logging.error(f"Error processing future: {str(e)}")
+
+        well_formed_ids = []
+        for snapshot_id in snapshot_ids:
+            if len(snapshot_id.split('/')) < 9:
+                logging.error(f"Invalid snapshot ID format: {snapshot_id}")
+                results["Unknown"]["invalid"].append((snapshot_id, "Invalid snapshot ID format"))
                 progress.update(task, advance=1)
+            else:
+                well_formed_ids.append(snapshot_id)
+
+        # az still prints the snapshots it found when some IDs in a chunk are missing
+        for chunk, result in batched_az("snapshot show", well_formed_ids):
+            if result.returncode != 0:
+                logging.error(f"az snapshot show reported errors for a batch of {len(chunk)}: {result.stderr.decode(errors='replace').strip()}")
+            try:
+                existing_ids = parse_snapshot_ids(result.stdout)
+            except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+                logging.error(f"Error parsing az snapshot show output: {str(e)}")
+                for snapshot_id in chunk:
+                    results["Unknown"]["error"].append((snapshot_id, str(e)))
+                progress.update(task, advance=len(chunk))
+                continue
+
+            for snapshot_id in chunk:
+                parts = snapshot_id.split('/')
+                subscription_name = subscription_names.get(parts[2], parts[2])
+                if snapshot_id.lower() in existing_ids:
+                    status, error = "valid", None
+                elif result.returncode == 0:
+                    status, error = "non-existent", None
+                else:
+                    # A failed batch may have stopped early, so check whatever it did not return one at a time
+                    status, error = show_snapshot_status(snapshot_id)
+
+                if status == "valid":
+                    results[subscription_name]["valid"].append(parts[-1])
+                    valid_snapshots.append(snapshot_id)
+                elif status == "non-existent":
+                    results[subscription_name]["non-existent"].append(parts[-1])
+                else:
+                    results[subscription_name]["error"].append((parts[-1], error))
+            progress.update(task, advance=len(chunk))
 
     return valid_snapshots, results
 
@@ -165,24 +202,23 @@ def delete_valid_snapshots(valid_snapshots, subscription_names):
 
     with Progress() as progress:
         task = progress.add_task("[cyan]Deleting valid snapshots...", total=len(valid_snapshots))
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_snapshot = {executor.submit(delete_snapshot, snapshot_id): snapshot_id for snapshot_id in valid_snapshots}
-            for future in as_completed(future_to_snapshot):
-                snapshot_id = future_to_snapshot[future]
-                try:
-                    success = future.result()
-                    parts = snapshot_id.split('/')
-                    subscription_id = parts[2]
-                    subscription_name = subscription_names.get(subscription_id, subscription_id)
-                    snapshot_name = parts[-1]
-                    if success:
-                        results[subscription_name]["deleted"].append(snapshot_name)
-                    else:
-                        results[subscription_name]["failed"].append((snapshot_name, "Deletion failed"))     
-                except Exception as e:
-                    logging.error(f"Error deleting snapshot {snapshot_id}: {str(e)}")
-                    results["Unknown"]["error"].append((snapshot_id, str(e)))
-                progress.update(task, advance=1)
+        for chunk, result in batched_az("snapshot delete", valid_snapshots):
+            if result.returncode == 0:
+                outcomes = [(snapshot_id, True) for snapshot_id in chunk]
+            else:
+                # az does not say which IDs in the batch failed, so retry them one at a time
+                logging.error(f"az snapshot delete reported errors for a batch of {len(chunk)}: {result.stderr.decode(errors='replace').strip()}")
+                outcomes = [(snapshot_id, delete_snapshot(snapshot_id)) for snapshot_id in chunk]
+
+            for snapshot_id, success in outcomes:
+                parts = snapshot_id.split('/')
+                subscription_name = subscription_names.get(parts[2], parts[2])
+                snapshot_name = parts[-1]
+                if success:
+                    results[subscription_name]["deleted"].append(snapshot_name)
+                else:
+                    results[subscription_name]["failed"].append((snapshot_name, "Deletion failed"))
+            progress.update(task, advance=len(chunk))
 
     return results
 
@@ -278,7 +314,7 @@ def main():
 
         try:
             with open(filename, 'r') as f:
-                snapshot_ids = f.read().splitlines()
+                snapshot_ids = [line.strip() for line in f if line.strip()]
         except Exception as e:
             console.print(f"[bold red]Error reading file {filename}: {e}[/bold red]")
             return
@@ -327,27 +363,36 @@ def main():
         os.makedirs(logs_dir, exist_ok=True)
         log_filename = os.path.join(logs_dir, f"snapshot_deletion_log_{user_id}_{current_time}.txt")
         
+        lines = [
+            "Snapshot Deletion Log",
+            "=====================",
+            "",
+            f"User: {user_id}",
+            f"Date and Time: {current_time}",
+            "",
+            "Summary:",
+        ]
+        for subscription_name, data in results.items():
+            lines.extend([
+                "",
+                f"Subscription: {subscription_name}",
+                f"  Valid Snapshots: {len(data['valid'])}",
+                f"  Non-existent Snapshots: {len(data['non-existent'])}",
+                f"  Deleted Snapshots: {len(data['deleted'])}",
+                f"  Failed Deletions: {len(data['failed'])}",
+            ])
+
+        lines.extend(["", "Deleted Snapshots:"])
+        for subscription_name, data in results.items():
+            if data['deleted']:
+                lines.extend(["", f"Subscription: {subscription_name}"])
+                lines.extend(f"  • {snapshot}" for snapshot in data['deleted'])
+
+        lines.extend(["", f"Total Runtime: {total_runtime:.2f} seconds"])
+
+        # Build the whole log first and write it in one call
         with open(log_filename, 'w') as log_file:
-            log_file.write("Snapshot Deletion Log\n")
-            log_file.write("=====================\n\n")
-            log_file.write(f"User: {user_id}\n")
-            log_file.write(f"Date and Time: {current_time}\n\n")
-            log_file.write("Summary:\n")
-            for subscription_name, data in results.items():
-                log_file.write(f"\nSubscription: {subscription_name}\n")
-                log_file.write(f"  Valid Snapshots: {len(data['valid'])}\n")
-                log_file.write(f"  Non-existent Snapshots: {len(data['non-existent'])}\n")
-                log_file.write(f"  Deleted Snapshots: {len(data['deleted'])}\n")
-                log_file.write(f"  Failed Deletions: {len(data['failed'])}\n")
-            
-            log_file.write("\nDeleted Snapshots:\n")
-            for subscription_name, data in results.items():
-                if data['deleted']:
-                    log_file.write(f"\nSubscription: {subscription_name}\n")
-                    for snapshot in data['deleted']:
-                        log_file.write(f"  • {snapshot}\n")
-            
-            log_file.write(f"\nTotal Runtime: {total_runtime:.2f} seconds\n")
+            log_file.write("\n".join(lines) + "\n")
 
         console.print(f"[green]✔ Log file created: {log_filename}[/green]")
 
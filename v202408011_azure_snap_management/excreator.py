@@ -1,13 +1,18 @@
 import os
 import asyncio
-import json
 import datetime
 import getpass
-import csv
+import random
+import configparser
+import functools
+from dataclasses import dataclass
 from collections import defaultdict
-from functools import lru_cache
 from concurrent.futures import ThreadPoolExecutor
 import aiofiles
+import aiohttp
+import orjson
+from azure.core.exceptions import ClientAuthenticationError
+from azure.identity.aio import DefaultAzureCredential
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
 from rich.live import Live
@@ -22,32 +27,154 @@ timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 log_dir = "logs"
 log_file = os.path.join(log_dir, f"snapshot_creation_log_{user_id}_{timestamp}.txt")
 summary_file = os.path.join(log_dir, f"snapshot_summary_{user_id}_{timestamp}.txt")
-snap_rid_list_file = "snap_rid_list.txt"
 chg_number = ""
-expire_days = 3
-semaphore = asyncio.Semaphore(10)
-successful_snapshots = []
-failed_snapshots = []
-inventory_file = 'linux_vm-inventory.csv'
-
-@lru_cache(maxsize=None)
-def get_vm_info(hostname, inventory_file):
-    with open(inventory_file, 'r', newline='') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if hostname in row:
-                return ','.join(row)
-    return None
+sub_semaphores = {}
+arm_endpoint = "https://management.azure.com"
+batch_size = 20
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    expire_days: int
+    semaphore_value: int
+    inventory_file: str
+    snapshot_vmlist_file: str
+    snap_rid_list_file: str
+
+class AzureLoginError(Exception):
+    pass
+
+@functools.cache
+def config():
+    # Read once on first use so importing this module needs no config file
+    parser = configparser.ConfigParser()
+    parser.read('config.ini')
+    return Config(
+        expire_days=parser.getint('Snapshot', 'expire_days', fallback=3),
+        semaphore_value=parser.getint('Snapshot', 'semaphore_value', fallback=10),
+        inventory_file=parser.get('Snapshot', 'inventory_file', fallback='linux_vm-inventory.csv'),
+        snapshot_vmlist_file=parser.get('Snapshot', 'snapshot_vmlist_file', fallback='snapshot_vmlist.txt'),
+        snap_rid_list_file=parser.get('Snapshot', 'snap_rid_list_file', fallback='snap_rid_list.txt'),
+    )
+
+class BufferedLogWriter:
+    # Keeps one handle open and coalesces queued lines into a single write per batch
+    def __init__(self, path, max_batch=100, flush_interval=0.25):
+        self.path = path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def write(self, text):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain_loop())
+        self._queue.put_nowait(text)
+
+    async def _drain_loop(self):
+        async with aiofiles.open(self.path, "a") as f:
+            while True:
+                pending = [await self._queue.get()]
+                if self._queue.qsize() < self.max_batch - 1:
+                    await asyncio.sleep(self.flush_interval)
+                while len(pending) < self.max_batch and not self._queue.empty():
+                    pending.append(self._queue.get_nowait())
+                await f.write(''.join(pending))
+                await f.flush()
+                for _ in pending:
+                    self._queue.task_done()
+
+    async def flush(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # If the drain loop died (e.g. the file could not be opened or written), join() would never return
+        join = asyncio.create_task(self._queue.join())
+        await asyncio.wait({join, task}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            join.cancel()
+            task.result()
+        else:
+            task.cancel()
+
+def retry_after(headers, default):
+    # Retry-After may be an HTTP-date rather than seconds; anything but seconds falls back to the default
+    value = headers.get("Retry-After")
+    return int(value) if value and value.isdigit() else default
+
+class ArmRateLimiter:
+    # Holds back requests to a subscription once ARM reports its request budget is nearly spent
+    def __init__(self, low_watermark=10, pause=5):
+        self.low_watermark = low_watermark
+        self.pause = pause
+        self.remaining = {}
+        self._resume_at = {}
+
+    async def wait(self, subscription_id):
+        delay = self._resume_at.get(subscription_id, 0) - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, subscription_id, method, status, headers):
+        kind = "reads" if method == "GET" else "writes"
+        remaining = headers.get(f"x-ms-ratelimit-remaining-subscription-{kind}")
+        if remaining is not None:
+            self.remaining[(subscription_id, kind)] = int(remaining)
+
+        if status == 429:
+            pause = retry_after(headers, self.pause)
+        elif self.remaining.get((subscription_id, kind), self.low_watermark) < self.low_watermark:
+            pause = self.pause
+        else:
+            return
+        resume_at = asyncio.get_running_loop().time() + pause
+        self._resume_at[subscription_id] = max(self._resume_at.get(subscription_id, 0), resume_at)
+
+log_writer = BufferedLogWriter(log_file)
+rid_writer = None
+rate_limiter = ArmRateLimiter()
+log_timestamp = ""
+
+inventory = None
+
+def sub_semaphore(subscription_id):
+    # ARM write limits apply per subscription, so each one gets its own concurrency budget
+    if subscription_id not in sub_semaphores:
+        sub_semaphores[subscription_id] = asyncio.Semaphore(config().semaphore_value)
+    return sub_semaphores[subscription_id]
+
+def load_inventory():
+    # Index the inventory once; each row is "resource_id vm_name [disk_id location]".
+    # Rows are keyed by full VM name and by the trailing hostname (after the last '-'), first row wins
+    global inventory
+    if inventory is None:
+        with open(config().inventory_file, 'r') as f:
+            rows = [line.strip() for line in f if len(line.split()) > 1]
+        by_name = {}
+        by_hostname = {}
+        for row in rows:
+            vm_name = row.split()[1]
+            by_name.setdefault(vm_name, row)
+            by_hostname.setdefault(vm_name.rpartition('-')[2], row)
+        inventory = (by_name, by_hostname, rows)
+    return inventory
+
+def get_vm_info(hostname):
+    by_name, by_hostname, rows = load_inventory()
+    vm_info = by_name.get(hostname) or by_hostname.get(hostname)
+    if vm_info is None:
+        # Anything else falls back to the original substring match
+        vm_info = next((row for row in rows if hostname in row), None)
+    return vm_info
 
 async def extract_vm_info(host_file):
-    snapshot_vmlist_file = 'snapshot_vmlist.txt'
+    snapshot_vmlist_file = config().snapshot_vmlist_file
     if not os.path.exists(snapshot_vmlist_file):
         console.print(f"[bold red]Error: Snapshot VM list file '{snapshot_vmlist_file}' not found.[/bold red]")
         return None
 
     async with aiofiles.open(snapshot_vmlist_file, 'r') as f:
         vm_list = await f.read()
-        vm_list = vm_list.splitlines()
+        vm_list = [line for line in vm_list.splitlines() if line.strip()]
 
     if not vm_list:
         console.print(f"[bold red]Error: No VM information found in '{snapshot_vmlist_file}'.[/bold red]")
@@ -55,71 +182,208 @@ async def extract_vm_info(host_file):
 
     return vm_list
 
-async def run_az_command(command, max_retries=3, delay=5):
+async def get_access_token():
+    # Reuses cached credentials in-process instead of spawning az for every run
+    try:
+        async with DefaultAzureCredential() as credential:
+            token = await credential.get_token(f"{arm_endpoint}/.default")
+    except ClientAuthenticationError as e:
+        await write_log(f"Failed to get access token | Error: {e}")
+        return None
+    return token.token
+
+def build_batch(resource_ids):
+    return {
+        "requests": [
+            {"httpMethod": "GET", "url": f"{resource_id}?api-version=2023-03-01", "name": str(i)}
+            for i, resource_id in enumerate(resource_ids)
+        ]
+    }
+
+async def arm_request(session, method, url, body=None, max_retries=3, base_delay=1.0, max_delay=30, jitter=0.5):
+    subscription_id = url.split("/subscriptions/")[1].split("/")[0] if "/subscriptions/" in url else None
     for attempt in range(max_retries):
-        process = await asyncio.create_subprocess_shell(
-            command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        if process.returncode == 0:
-            return stdout.decode().strip(), stderr.decode().strip(), process.returncode
-        else:
-            write_log(f"Command failed (attempt {attempt + 1}): {command}")
-            write_log(f"Error: {stderr.decode().strip()}")
-            if attempt < max_retries - 1:
-                write_log(f"Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-    return "", stderr.decode().strip(), process.returncode
+        await rate_limiter.wait(subscription_id)
+        try:
+            async with session.request(method, url, json=body) as response:
+                content = await response.read()
+                rate_limiter.update(subscription_id, method, response.status, response.headers)
+                if response.status < 400:
+                    return orjson.loads(content) if content else {}, response.headers, None
+                error = f"HTTP {response.status}: {content.decode()}"
+                if response.status == 401:
+                    # An expired or rejected token fails every remaining call, so stop the run
+                    raise AzureLoginError(error)
+                retryable = response.status == 429 or response.status >= 500
+        except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
+            error = repr(e)
+            retryable = True
+        await write_log(f"Request failed (attempt {attempt + 1}): {method} {url}")
+        await write_log(f"Error: {error}")
+        if not retryable:
+            break
+        if attempt < max_retries - 1:
+            delay = min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
+            await write_log(f"Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+    return None, None, error
+
+async def post_batch(session, resource_ids):
+    data, headers, error = await arm_request(session, "POST", f"{arm_endpoint}/batch?api-version=2020-06-01", build_batch(resource_ids))
+    # ARM answers 202 with a Location to poll when the batch is still running
+    while error is None and "responses" not in data:
+        if "Location" not in headers:
+            await write_log(f"Batch request returned neither responses nor a Location to poll: {data}")
+            return None
+        await asyncio.sleep(retry_after(headers, 1))
+        data, headers, error = await arm_request(session, "GET", headers["Location"])
+    return data["responses"] if error is None else None
+
+async def create_snapshot(session, snapshot_id, location, disk_id):
+    url = f"{arm_endpoint}{snapshot_id}?api-version=2023-04-02"
+    body = {
+        "location": location,
+        "properties": {"creationData": {"createOption": "Copy", "sourceResourceId": disk_id}},
+    }
+    data, headers, error = await arm_request(session, "PUT", url, body)
+    if error is not None:
+        return None, error
+
+    operation_url = headers.get("Azure-AsyncOperation")
+    if operation_url is None:
+        return data, None
+
+    while True:
+        await asyncio.sleep(retry_after(headers, 5))
+        operation, headers, error = await arm_request(session, "GET", operation_url)
+        if error is not None:
+            return None, error
+        if operation["status"] == "Succeeded":
+            # Compute operations return the finished snapshot as output; fall back to the PUT body
+            return operation.get("properties", {}).get("output", data), None
+        if operation["status"] in ("Failed", "Canceled"):
+            return None, operation.get("error", operation["status"])
+
+async def get_vm_details(session, vms):
+    chunks = [vms[i:i + batch_size] for i in range(0, len(vms), batch_size)]
+    results = await asyncio.gather(*(post_batch(session, [resource_id for resource_id, *_ in chunk]) for chunk in chunks))
+
+    vm_details = {}
+    for chunk, responses in zip(chunks, results):
+        responses_by_name = {response["name"]: response for response in responses or []}
+        for i, (resource_id, vm_name, *_) in enumerate(chunk):
+            response = responses_by_name.get(str(i))
+            if response is None or response["httpStatusCode"] != 200:
+                error = response["content"] if response else "No response from batch request"
+                await write_log(f"Failed to get VM details for {vm_name}")
+                await write_log(f"Error: {error}")
+                continue
+            content = response["content"]
+            # VMs on unmanaged (VHD) disks have no managed OS disk to snapshot
+            managed_disk = content.get("properties", {}).get("storageProfile", {}).get("osDisk", {}).get("managedDisk")
+            if not managed_disk or not content.get("location"):
+                await write_log(f"Failed to get VM details for {vm_name}")
+                await write_log("Error: VM has no managed OS disk")
+                continue
+            vm_details[resource_id] = {
+                "location": content["location"],
+                "diskId": managed_disk["id"],
+            }
+    return vm_details
+
+async def refresh_log_timestamp():
+    # write_log reads this coarse clock instead of formatting now() for every line
+    global log_timestamp
+    while True:
+        log_timestamp = datetime.datetime.now().isoformat(sep=' ', timespec='milliseconds')
+        await asyncio.sleep(0.1)
 
 async def write_log(message):
-    async with aiofiles.open(log_file, "a") as f:
-        await f.write(f"{datetime.datetime.now()}: {message}\n")
-
-def write_snapshot_rid(snapshot_id):
-    with open(snap_rid_list_file, "a") as f:
-        f.write(f"{snapshot_id}\n")
-
-async def process_vm(resource_id, vm_name, resource_group, disk_id, progress, task):
-    async with semaphore:
-        await write_log(f"Processing VM: {vm_name}")
-        await write_log(f"Resource ID: {resource_id}")
-        await write_log(f"Resource group: {resource_group}")
-
-        snapshot_name = f"RH_{chg_number}_{vm_name}_{timestamp}"
-        stdout, stderr, returncode = await run_az_command(
-            f"az snapshot create --name {snapshot_name} --resource-group {resource_group} --source {disk_id}"
-        )
-        
-        if returncode != 0:
-            await write_log(f"Failed to create snapshot for VM: {vm_name}")
-            await write_log(f"Error: {stderr}")
-            failed_snapshots.append((vm_name, "Failed to create snapshot"))
+    log_writer.write(f"{log_timestamp}: {message}\n")
+
+async def write_snapshot_rid(snapshot_id):
+    rid_writer.write(f"{snapshot_id}\n")
+
+async def process_vm(session, resource_id, vm_name, resource_group, location, disk_id, progress, overall_task):
+    subscription_id = resource_id.split("/")[2]
+    # The run-wide timestamp keeps every snapshot in a batch under the same suffix
+    snapshot_name = f"RH_{chg_number}_{vm_name}_{timestamp}"
+    async with sub_semaphore(subscription_id):
+        await write_log(f"Processing VM: {vm_name} | Resource ID: {resource_id} | Resource group: {resource_group}")
+
+        # Anything but a login failure stays with this VM instead of cancelling the whole TaskGroup
+        try:
+            snapshot_data, error = await create_snapshot(
+                session,
+                f"/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/Microsoft.Compute/snapshots/{snapshot_name}",
+                location,
+                disk_id,
+            )
+        except AzureLoginError:
+            raise
+        except Exception as e:
+            snapshot_data, error = None, repr(e)
+
+        if error is not None:
+            await write_log(f"Failed to create snapshot for VM: {vm_name} | Error: {error}")
+            console.print(f"[red]Failed to create snapshot for VM: {vm_name}[/red]")
+            result = (vm_name, "Failed to create snapshot")
         else:
-            await write_log(f"Snapshot created: {snapshot_name}")
-            await write_log(json.dumps(json.loads(stdout), indent=2))
-            
-            snapshot_data = json.loads(stdout)
+            message = f"Snapshot created: {snapshot_name}\n{orjson.dumps(snapshot_data, option=orjson.OPT_INDENT_2).decode()}\n"
             snapshot_id = snapshot_data.get('id')
             if snapshot_id:
-                write_snapshot_rid(snapshot_id)
-                await write_log(f"Snapshot resource ID added to snap_rid_list.txt: {snapshot_id}")
-                successful_snapshots.append((vm_name, snapshot_name))
+                await write_snapshot_rid(snapshot_id)
+                await write_log(f"{message}Snapshot resource ID added to snap_rid_list.txt: {snapshot_id}")
+                result = (vm_name, snapshot_name)
             else:
-                await write_log(f"Warning: Could not extract snapshot resource ID for {snapshot_name}")
-                failed_snapshots.append((vm_name, "Failed to extract snapshot ID"))
+                await write_log(f"{message}Warning: Could not extract snapshot resource ID for {snapshot_name}")
+                result = (vm_name, "Failed to extract snapshot ID")
 
-        progress.update(task, completed=100)
+        progress.update(overall_task, advance=1)
+        return result
 
 def group_vms_by_subscription(vm_list):
+    # Rows may carry the OS disk ID and location after the VM name, which saves a VM lookup
     grouped_vms = defaultdict(list)
     for line in vm_list:
-        resource_id, vm_name = line.rsplit(None, 1)
-        subscription_id = resource_id.split("/")[2]
-        grouped_vms[subscription_id].append((resource_id, vm_name))
+        fields = line.split()
+        resource_id, vm_name = fields[0], fields[1]
+        disk_id = fields[2] if len(fields) > 3 else None
+        location = fields[3] if len(fields) > 3 else None
+        # Only the subscription segment is needed, so stop splitting after it
+        grouped_vms[resource_id.split("/", 3)[2]].append((resource_id, vm_name, disk_id, location))
     return grouped_vms
 
+async def process_subscription(session, subscription_id, vms, progress, overall_task):
+    await write_log(f"Processing subscription: {subscription_id}")
+    lookup = [vm for vm in vms if not (vm[2] and vm[3])]
+    try:
+        vm_details = await get_vm_details(session, lookup) if lookup else {}
+    except AzureLoginError:
+        raise
+    except Exception as e:
+        # Leave the subscription's other VMs and the other subscriptions running; these VMs fail below
+        await write_log(f"Failed to get VM details for subscription: {subscription_id} | Error: {e!r}")
+        vm_details = {}
+
+    results = []
+    tasks = []
+    async with asyncio.TaskGroup() as tg:
+        for resource_id, vm_name, disk_id, location in vms:
+            resource_group = resource_id.split("/")[4]
+            if not (disk_id and location):
+                if resource_id not in vm_details:
+                    results.append((vm_name, "Failed to get VM details"))
+                    console.print(f"[red]Failed to get VM details for VM: {vm_name}[/red]")
+                    progress.update(overall_task, advance=1)
+                    continue
+                location = vm_details[resource_id]['location']
+                disk_id = vm_details[resource_id]['diskId']
+
+            tasks.append(tg.create_task(process_vm(session, resource_id, vm_name, resource_group, location, disk_id, progress, overall_task)))
+
+    return results + [task.result() for task in tasks]
+
 async def main():
     global chg_number
 
@@ -151,54 +415,43 @@ async def main():
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
         TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+        TextColumn("({task.completed}/{task.total})"),
         expand=True
     )
-    
-    vm_tasks = {}
-    for subscription_id, vms in grouped_vms.items():
-        for resource_id, vm_name in vms:
-            vm_tasks[vm_name] = progress.add_task(f"[cyan]{vm_name}", total=100)
 
+    # One bar for the whole run; per-VM rows made every refresh scale with the VM count
     overall_task = progress.add_task("[bold green]Overall Progress", total=total_vms)
 
-    with Live(Panel(progress), refresh_per_second=4) as live:
-        for subscription_id, vms in grouped_vms.items():
-            # Switch to the current subscription
-            stdout, stderr, returncode = await run_az_command(f"az account set --subscription {subscription_id}")
-            if returncode != 0:
-                await write_log(f"Failed to set subscription ID: {subscription_id}")
-                await write_log(f"Error: {stderr}")
-                for _, vm_name in vms:
-                    failed_snapshots.append((vm_name, "Failed to set subscription"))
-                    progress.update(vm_tasks[vm_name], completed=100)
-                    progress.update(overall_task, advance=1)
-                continue
-
-            await write_log(f"Switched to subscription: {subscription_id}")
-
-            tasks = []
-            for resource_id, vm_name in vms:
-                # Get resource group and disk ID for each VM
-                stdout, stderr, returncode = await run_az_command(
-                    f"az vm show --ids {resource_id} --query '{{resourceGroup:resourceGroup, diskId:storageProfile.osDisk.managedDisk.id}}' -o json"
-                )
-                if returncode != 0:
-                    await write_log(f"Failed to get VM details for {vm_name}")
-                    await write_log(f"Error: {stderr}")
-                    failed_snapshots.append((vm_name, "Failed to get VM details"))
-                    progress.update(vm_tasks[vm_name], completed=100)
-                    progress.update(overall_task, advance=1)
-                    continue
+    token = await get_access_token()
+    if token is None:
+        console.print("[bold red]Error: Failed to get an Azure access token. Please run 'az login' and try again.[/bold red]")
+        return
 
-                vm_details = json.loads(stdout)
-                resource_group = vm_details['resourceGroup']
-                disk_id = vm_details['diskId']
+    connector = aiohttp.TCPConnector(limit=100)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        headers={"Authorization": f"Bearer {token}"},
+        json_serialize=lambda obj: orjson.dumps(obj).decode(),
+    ) as session:
+        login_error = None
+        try:
+            with Live(Panel(progress), refresh_per_second=4) as live:
+                async with asyncio.TaskGroup() as tg:
+                    subscription_tasks = [
+                        tg.create_task(process_subscription(session, subscription_id, vms, progress, overall_task))
+                        for subscription_id, vms in grouped_vms.items()
+                    ]
+        except* AzureLoginError as eg:
+            login_error = eg.exceptions[0]
+
+    if login_error is not None:
+        await write_log(f"Aborted: {login_error}")
+        console.print("[bold red]Error: Azure rejected the access token. Please run 'az login' and try again.[/bold red]")
+        return
 
-                task = asyncio.create_task(process_vm(resource_id, vm_name, resource_group, disk_id, progress, vm_tasks[vm_name]))
-                tasks.append(task)
-            
-            await asyncio.gather(*tasks)
-            progress.update(overall_task, advance=len(vms))
+    results = [result for task in subscription_tasks for result in task.result()]
+    successful_snapshots = [result for result in results if not result[1].startswith("Failed")]
+    failed_snapshots = [result for result in results if result[1].startswith("Failed")]
 
     # Display summary table
     table = Table(title="Snapshot Creation Summary")
@@ -209,24 +462,43 @@ async def main():
     table.add_row("Failed Snapshots", str(len(failed_snapshots)))
     console.print(table)
 
-    # Write summary to file
+    # Write summary to file in one write
+    summary = [
+        "Snapshot Creation Summary",
+        "=========================",
+        "",
+        f"Total VMs processed: {total_vms}",
+        f"Successful snapshots: {len(successful_snapshots)}",
+        f"Failed snapshots: {len(failed_snapshots)}",
+        "",
+        "Successful snapshots:",
+        *(f"- {vm}: {snapshot}" for vm, snapshot in successful_snapshots),
+        "",
+        "Failed snapshots:",
+        *(f"- {vm}: {error}" for vm, error in failed_snapshots),
+    ]
     with open(summary_file, "w") as f:
-        f.write("Snapshot Creation Summary\n")
-        f.write("=========================\n\n")
-        f.write(f"Total VMs processed: {total_vms}\n")
-        f.write(f"Successful snapshots: {len(successful_snapshots)}\n")
-        f.write(f"Failed snapshots: {len(failed_snapshots)}\n\n")
-        f.write("Successful snapshots:\n")
-        for vm, snapshot in successful_snapshots:
-            f.write(f"- {vm}: {snapshot}\n")
-        f.write("\nFailed snapshots:\n")
-        for vm, error in failed_snapshots:
-            f.write(f"- {vm}: {error}\n")
+        f.write("\n".join(summary) + "\n")
 
     console.print("\n[bold green]Snapshot creation process completed.[/bold green]")
     console.print(f"Detailed log: {log_file}")
     console.print(f"Summary: {summary_file}")
-    console.print(f"Snapshot resource IDs: {snap_rid_list_file}")
+    console.print(f"Snapshot resource IDs: {config().snap_rid_list_file}")
+
+async def run():
+    global rid_writer
+    rid_writer = BufferedLogWriter(config().snap_rid_list_file)
+    timestamp_task = asyncio.create_task(refresh_log_timestamp())
+    await asyncio.sleep(0)
+    try:
+        await main()
+    finally:
+        timestamp_task.cancel()
+        # The snapshot IDs are still flushed if the log file could not be written
+        try:
+            await log_writer.flush()
+        finally:
+            await rid_writer.flush()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run())
@@ -1,9 +1,16 @@
 import subprocess
+import asyncio
+import random
 import datetime
-import json
+import aiohttp
+import orjson
 import os
 import getpass
 import time
+import functools
+import csv
+import logging
+from dataclasses import dataclass
 from rich.console import Console, Group
 from rich.table import Table
 from rich.prompt import Confirm
@@ -14,41 +21,144 @@ from rich.live import Live
 
 console = Console()
 
-# Get the user's UID
-user_uid = getpass.getuser()
-
-# Create a log directory if it doesn't exist
 log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
 
-# Create an error log file with the user's UID in the file name
-error_log_file = os.path.join(log_dir, f"error_log_{user_uid}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.txt")
+@dataclass(frozen=True, slots=True)
+class RunPaths:
+    user_uid: str
+    error_log_file: str
+
+@functools.cache
+def run_paths():
+    # Built on first use so importing this module touches no files and the log name carries the run's start time
+    os.makedirs(log_dir, exist_ok=True)
+    user_uid = getpass.getuser()
+    return RunPaths(
+        user_uid=user_uid,
+        error_log_file=os.path.join(log_dir, f"error_log_{user_uid}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.txt"),
+    )
+
+@dataclass(frozen=True, slots=True)
+class SnapshotResult:
+    id: str
+    name: str
+    exists: bool = False
+    resource_group: str = 'N/A'
+    time_created: str = 'N/A'
+    size_gb: int | str = 'N/A'
+    state: str = 'N/A'
+
+@functools.cache
+def error_logger():
+    # One handler kept open for the run; the file is only created once something is logged
+    handler = logging.FileHandler(run_paths().error_log_file, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
+    logger = logging.getLogger("snapshot_errors")
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
 
 def log_error(message):
-    with open(error_log_file, "a") as f:
-        f.write(f"{datetime.datetime.now()}: {message}\n")
+    error_logger().error(message)
 
-def run_az_command(command):
+def env_concurrency(name, default):
+    # Read at import, so a typo must not stop the script; a semaphore below 1 would block every lookup
+    value = os.environ.get(name)
+    if value is None:
+        return default
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        log_error(f"Error running command: {command}\nError: {e.stderr}")
+        concurrency = int(value)
+    except ValueError:
+        console.print(f"[yellow]Warning: {name}={value!r} is not a number; using {default}.[/yellow]")
+        return default
+    if concurrency < 1:
+        console.print(f"[yellow]Warning: {name}={concurrency} is below 1; using 1.[/yellow]")
+        return 1
+    return concurrency
+
+arm_endpoint = "https://management.azure.com"
+snapshot_api_version = "2023-04-02"
+# Concurrent ARM GETs; one token and one connection pool serve all of them.
+# Past ~30 in flight ARM starts throttling, so stay under that unless told otherwise
+max_concurrency = env_concurrency("SNAP_VALIDATE_CONCURRENCY", 20)
+# Above this many snapshots the valid/invalid tables are written to CSV instead
+max_table_rows = 500
+
+def get_access_token():
+    args = ["az", "account", "get-access-token", "--query", "accessToken", "-o", "tsv"]
+    result = subprocess.run(args, capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        log_error(f"Error running command: {' '.join(args)}\nError: {result.stderr}")
         return None
+    return result.stdout.strip()
+
+async def get_snapshot(session, semaphore, auth_failed, snapshot_id, max_retries=4, base_delay=1.0, max_delay=30, jitter=1.0):
+    # Returns ("found", body), ("missing", None) or ("unvalidated", None)
+    async with semaphore:
+        for attempt in range(max_retries):
+            # Once ARM rejects the token, every later request would be rejected the same way
+            if auth_failed.is_set():
+                return "unvalidated", None
+            retry_after = None
+            try:
+                async with session.get(f"{arm_endpoint}{snapshot_id}?api-version={snapshot_api_version}") as response:
+                    if response.status == 200:
+                        return "found", orjson.loads(await response.read())
+                    if response.status == 401:
+                        auth_failed.set()
+                        log_error(f"ARM rejected the token for snapshot: {snapshot_id}\nError: {await response.text()}")
+                        return "unvalidated", None
+                    if response.status == 403:
+                        log_error(f"Not authorized to read snapshot: {snapshot_id}\nError: {await response.text()}")
+                        return "unvalidated", None
+                    if response.status in (400, 404):
+                        return "missing", None
+                    log_error(f"ARM returned {response.status} for snapshot: {snapshot_id} (attempt {attempt + 1})")
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log_error(f"Request failed for snapshot: {snapshot_id} (attempt {attempt + 1})\nError: {e!r}")
+            if attempt < max_retries - 1:
+                # Jitter keeps throttled lookups from retrying in lockstep; ARM's Retry-After is a floor
+                delay = min(max_delay, base_delay * 2 ** attempt) + random.uniform(0, jitter)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                await asyncio.sleep(delay)
+    return "unvalidated", None
+
+async def fetch_snapshots(snapshot_ids, token, progress, task):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    auth_failed = asyncio.Event()
+
+    connector = aiohttp.TCPConnector(limit=64, keepalive_timeout=300)
+    async with aiohttp.ClientSession(connector=connector, headers={"Authorization": f"Bearer {token}"}) as session:
+        async def fetch(snapshot_id):
+            result = await get_snapshot(session, semaphore, auth_failed, snapshot_id)
+            progress.update(task, advance=1)
+            return result
+
+        # If one lookup raises, the group cancels the rest instead of leaving them running
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(fetch(snapshot_id)) for snapshot_id in snapshot_ids]
+    return [task.result() for task in tasks], auth_failed.is_set()
 
 def extract_snapshot_name(snapshot_id):
-    parts = snapshot_id.split('/')
-    full_name = parts[-1]
-    name_parts = full_name.rsplit('_', 1)
-    return name_parts[0]
+    # rpartition slices the string without building intermediate lists
+    full_name = snapshot_id.rpartition('/')[2]
+    return full_name.rpartition('_')[0] or full_name
 
 def validate_snapshots(snapshot_list_file):
+    paths = run_paths()
     console.print(Panel.fit("[bold cyan]Starting snapshot validation...[/bold cyan]", border_style="cyan"))
 
     with open(snapshot_list_file, "r") as file:
-        snapshot_ids = file.read().splitlines()
+        snapshot_ids = [line.strip() for line in file if line.strip()]
 
     total_snapshots = len(snapshot_ids)
+    # Look each snapshot up once however often it is listed; ARM IDs are case-insensitive
+    first_seen = {}
+    for snapshot_id in snapshot_ids:
+        first_seen.setdefault(snapshot_id.lower(), snapshot_id)
+    unique_ids = list(first_seen.values())
     validated_snapshots = []
 
     overall_progress = Progress(
@@ -60,80 +170,80 @@ def validate_snapshots(snapshot_list_file):
         expand=True
     )
 
-    snapshot_progress = Progress(
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(bar_width=None),
-        TextColumn("{task.completed:.0f}/{task.total:.0f}"),
-        TimeRemainingColumn(),
-        expand=True
-    )
+    overall_task = overall_progress.add_task("[green]Validating snapshots", total=len(unique_ids))
 
-    overall_task = overall_progress.add_task("[green]Overall progress", total=total_snapshots)
-    current_task = snapshot_progress.add_task("Validating snapshot", total=1, visible=True)
+    snapshot_start_time = time.time()
 
-    progress_group = Group(
-        Panel(overall_progress, title="Overall Progress", border_style="green"),
-        Panel(snapshot_progress, title="Current Snapshot", border_style="blue")
-    )
+    token = get_access_token()
+    if token is None:
+        console.print("[bold red]Failed to get an Azure access token; snapshots are not validated. Please run 'az login' and try again.[/bold red]")
+        results = [("unvalidated", None)] * len(unique_ids)
+    else:
+        # A single bar refreshed at 4Hz, advanced as each lookup completes
+        with Live(Panel(overall_progress, title="Overall Progress", border_style="green"), refresh_per_second=4):
+            results, auth_failed = asyncio.run(fetch_snapshots(unique_ids, token, overall_progress, overall_task))
+        if auth_failed:
+            console.print("[bold red]Azure rejected the login; some snapshots are not validated. Please run 'az login' and try again.[/bold red]")
+
+    results_by_id = {snapshot_id.lower(): result for snapshot_id, result in zip(unique_ids, results)}
+    valid_count = 0
+    for snapshot_id in snapshot_ids:
+        status, details = results_by_id[snapshot_id.lower()]
+        snapshot_name = extract_snapshot_name(snapshot_id)
+
+        if status == "found":
+            valid_count += 1
+            properties = details.get('properties', {})
+            snapshot_info = SnapshotResult(
+                id=snapshot_id,
+                name=snapshot_name,
+                exists=True,
+                resource_group=snapshot_id.split('/')[4],
+                time_created=properties.get('timeCreated'),
+                size_gb=properties.get('diskSizeGB'),
+                state=properties.get('provisioningState')
+            )
+        elif status == "unvalidated":
+            snapshot_info = SnapshotResult(id=snapshot_id, name=f"Not validated: {snapshot_name}")
+        else:
+            snapshot_info = SnapshotResult(id=snapshot_id, name=f"Not found: {snapshot_name}")
 
-    snapshot_start_time = time.time()
-    
-    with Live(progress_group, refresh_per_second=10) as live:
-        for snapshot_id in snapshot_ids:
-            snapshot_name = extract_snapshot_name(snapshot_id)
-            snapshot_info = {'id': snapshot_id, 'exists': False, 'name': snapshot_name}
-
-            
-            snapshot_progress.update(current_task, description=f"Validating: {snapshot_name:<50}", completed=0)
-
-            details = run_az_command(f"az snapshot show --ids {snapshot_id} --query '{{name:name, resourceGroup:resourceGroup, timeCreated:timeCreated, diskSizeGb:diskSizeGb, provisioningState:provisioningState}}' -o json")
-
-            if details:
-                try:
-                    details = json.loads(details)
-                    snapshot_info.update({
-                        'exists': True,
-                        'resource_group': details['resourceGroup'],
-                        'time_created': details['timeCreated'],
-                        'size_gb': details['diskSizeGb'],
-                        'state': details['provisioningState']
-                    })
-                except json.JSONDecodeError:
-                    log_error(f"Failed to parse JSON for snapshot: {snapshot_id}")
-            else:
-                snapshot_info['name'] = f"Not found: {snapshot_name}"
-
-            validated_snapshots.append(snapshot_info)
-            overall_progress.update(overall_task, advance=1)
-            
-            snapshot_end_time = time.time()
-            validation_time = snapshot_end_time - snapshot_start_time
-            snapshot_progress.update(current_task, description=f"Validated: {snapshot_name:<50} in {validation_time:.2f}s", completed=1)
-            
-            # Add a small delay to keep the spinner visible
-            time.sleep(0.5)
+        validated_snapshots.append(snapshot_info)
 
     end_time = time.time()
     runtime = end_time - snapshot_start_time
+    invalid_count = total_snapshots - valid_count
 
     console.print("\n")  # Add a newline for separation
 
-    # Create and display two separate tables for valid and invalid snapshots
-    valid_table = Table(title="Valid Snapshots", box=box.ROUNDED)
-    valid_table.add_column("Snapshot Name", style="cyan")
-    valid_table.add_column("Status", style="green", justify="center")
-
-    invalid_table = Table(title="Invalid Snapshots", box=box.ROUNDED)
-    invalid_table.add_column("Snapshot Name", style="cyan")
-    invalid_table.add_column("Status", style="red", justify="center")
-
-    for snapshot in validated_snapshots:
-        if snapshot['exists']:
-            valid_table.add_row(snapshot['name'], "✓")
-        else:
-            invalid_table.add_row(snapshot['name'], "✗")
+    if total_snapshots > max_table_rows:
+        # Rich lays out every row before drawing, so large runs go to a CSV instead of the console
+        csv_file = os.path.join(log_dir, f"snapshot_validation_{paths.user_uid}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+        with open(csv_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Snapshot ID", "Snapshot Name", "Status"])
+            writer.writerows(
+                (snapshot.id, snapshot.name, "Valid" if snapshot.exists else "Invalid")
+                for snapshot in validated_snapshots
+            )
+        console.print(Panel(f"[yellow]Too many snapshots to list here; per-snapshot results were written to {csv_file}[/yellow]", border_style="yellow"))
+    else:
+        # Create and display two separate tables for valid and invalid snapshots
+        valid_table = Table(title="Valid Snapshots", box=box.ROUNDED)
+        valid_table.add_column("Snapshot Name", style="cyan")
+        valid_table.add_column("Status", style="green", justify="center")
+
+        invalid_table = Table(title="Invalid Snapshots", box=box.ROUNDED)
+        invalid_table.add_column("Snapshot Name", style="cyan")
+        invalid_table.add_column("Status", style="red", justify="center")
+
+        for snapshot in validated_snapshots:
+            if snapshot.exists:
+                valid_table.add_row(snapshot.name, "✓")
+            else:
+                invalid_table.add_row(snapshot.name, "✗")
 
-    console.print(Panel(Group(valid_table, invalid_table), expand=False, border_style="green"))
+        console.print(Panel(Group(valid_table, invalid_table), expand=False, border_style="green"))
 
     # Create summary table
     summary_table = Table(title="Snapshot Validation Summary", box=box.ROUNDED)
@@ -141,8 +251,8 @@ def validate_snapshots(snapshot_list_file):
     summary_table.add_column("Count", style="magenta")
 
     summary_table.add_row("Total snapshots processed", str(total_snapshots))
-    summary_table.add_row("Valid snapshots", str(sum(1 for s in validated_snapshots if s['exists'])))
-    summary_table.add_row("Invalid snapshots", str(sum(1 for s in validated_snapshots if not s['exists'])))
+    summary_table.add_row("Valid snapshots", str(valid_count))
+    summary_table.add_row("Invalid snapshots", str(invalid_count))
 
     console.print(Panel(summary_table, expand=False, border_style="green"))
 
@@ -150,26 +260,31 @@ def validate_snapshots(snapshot_list_file):
 
     if Confirm.ask("Do you want to save the validation results to a log file?"):
         timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        log_file = os.path.join(log_dir, f"snapshot_validation_log_{user_uid}_{timestamp}.txt")
+        log_file = os.path.join(log_dir, f"snapshot_validation_log_{paths.user_uid}_{timestamp}.txt")
+        lines = ["Snapshot Validation Results", "===========================", ""]
+        for snapshot in validated_snapshots:
+            lines.append(f"Snapshot Name: {snapshot.name}")
+            lines.append(f"Exists: {'Yes' if snapshot.exists else 'No'}")
+            if snapshot.exists:
+                lines.extend([
+                    f"Resource Group: {snapshot.resource_group}",
+                    f"Time Created: {snapshot.time_created}",
+                    f"Size (GB): {snapshot.size_gb}",
+                    f"State: {snapshot.state}",
+                ])
+            lines.append("")
+        lines.extend([
+            "",
+            f"Total snapshots processed: {total_snapshots}",
+            f"Valid snapshots: {valid_count}",
+            f"Invalid snapshots: {invalid_count}",
+            f"Runtime: {runtime:.2f} seconds",
+        ])
         with open(log_file, "w") as f:
-            f.write("Snapshot Validation Results\n")
-            f.write("===========================\n\n")
-            for snapshot in validated_snapshots:
-                f.write(f"Snapshot Name: {snapshot['name']}\n")
-                f.write(f"Exists: {'Yes' if snapshot['exists'] else 'No'}\n")
-                if snapshot['exists']:
-                    f.write(f"Resource Group: {snapshot.get('resource_group', 'N/A')}\n")
-                    f.write(f"Time Created: {snapshot.get('time_created', 'N/A')}\n")
-                    f.write(f"Size (GB): {snapshot.get('size_gb', 'N/A')}\n")
-                    f.write(f"State: {snapshot.get('state', 'N/A')}\n")
-                f.write("\n")
-            f.write(f"\nTotal snapshots processed: {total_snapshots}\n")
-            f.write(f"Valid snapshots: {sum(1 for s in validated_snapshots if s['exists'])}\n")
-            f.write(f"Invalid snapshots: {sum(1 for s in validated_snapshots if not s['exists'])}\n")        
-            f.write(f"Runtime: {runtime:.2f} seconds\n")
+            f.write("\n".join(lines) + "\n")
         console.print(Panel(f"[bold green]Log file saved:[/bold green] {log_file}", border_style="green"))
 
-    console.print(Panel(f"[yellow]Note: Errors and details have been logged to: {error_log_file}[/yellow]", border_style="yellow"))
+    console.print(Panel(f"[yellow]Note: Errors and details have been logged to: {paths.error_log_file}[/yellow]", border_style="yellow"))
 
 if __name__ == "__main__":
     snapshot_list_file = input("Enter the path to the snapshot list file (default: snap_rid_list.txt): ") or "snap_rid_list.txt"
@@ -1,11 +1,24 @@
 import os
 
-def get_vm_info(hostname, inventory_file):
+def load_inventory(inventory_file):
+    # Index rows by full VM name and by the trailing hostname (after the last '-'); keep the first row for each key
     with open(inventory_file, 'r') as f:
-        for line in f:
-            if hostname in line:
-                return line.strip()
-    return None
+        rows = [line.strip() for line in f if len(line.split()) > 1]
+    by_name = {}
+    by_hostname = {}
+    for row in rows:
+        vm_name = row.split()[1]
+        by_name.setdefault(vm_name, row)
+        by_hostname.setdefault(vm_name.rpartition('-')[2], row)
+    return by_name, by_hostname, rows
+
+def get_vm_info(hostname, inventory):
+    by_name, by_hostname, rows = inventory
+    vm_info = by_name.get(hostname) or by_hostname.get(hostname)
+    if vm_info is None:
+        # Anything else falls back to the original substring match
+        vm_info = next((row for row in rows if hostname in row), None)
+    return vm_info
 
 def main():
     list_file = input("Enter the path to the list file containing hostnames: ")
@@ -20,13 +33,14 @@ def main():
         print(f"Error: List file '{list_file}' not found.")
         return
 
-    with open(list_file, 'r') as f:
-        hostnames = f.read().splitlines()
+    inventory = load_inventory(inventory_file)
 
     mode = 'a' if os.path.exists(output_file) else 'w'
-    with open(output_file, mode) as f:
-        for hostname in hostnames:
-            vm_info = get_vm_info(hostname, inventory_file)
+    with open(list_file, 'r') as hostnames, open(output_file, mode) as f:
+        for hostname in map(str.strip, hostnames):
+            if not hostname:
+                continue
+            vm_info = get_vm_info(hostname, inventory)
             if vm_info:
                 f.write(f"{vm_info}\n")
             else: